@@ -51,6 +51,20 @@
     on etl.batch_run(dataset, as_of_date);
   """) %}
 
+  {# Cache d'empreintes fichiers :
+     - évite de recalculer le SHA-256 d'un fichier inchangé à chaque run
+     - clé logique = (path, size, mtime_ns) ; un fichier modifié rate le
+       cache et son hash est recalculé puis upserté #}
+  {% do run_query("""
+    create table if not exists etl.file_fingerprint (
+      path text primary key,
+      size bigint not null,
+      mtime_ns bigint not null,
+      sha256 text not null,
+      computed_at timestamptz not null default now()
+    );
+  """) %}
+
   {# =========================
      Silver RAW tables (physiques, alimentées par Python)
      - on inclut aussi les champs ERP en plus (rib, rang_creance, date_reception)
@@ -88,6 +102,13 @@
 
   {# =========================
      GOLD tables (historisées - SCD2)
+
+     record_hash = colonne générée STORED: Postgres calcule le md5 des
+     colonnes métier (représentation ::text canonique + is_deleted) à
+     l'écriture. Les scripts n'insèrent plus de hash; l'expression doit
+     rester alignée sur record_hash_sql() de scripts/gold/scd2.py.
+     Migration d'une base existante: drop de l'ancienne colonne record_hash
+     puis ALTER TABLE ... ADD COLUMN avec la même définition générée.
      ========================= #}
 
   {% do run_query("""
@@ -102,7 +123,10 @@
       is_current boolean not null default true,
       is_deleted boolean not null default false,
 
-      record_hash text not null,
+      record_hash text not null generated always as (
+        md5(coalesce(nni::text,'') || '||' || coalesce(nom::text,'') || '||' ||
+            coalesce(prenom::text,'') || '||' || is_deleted::text)
+      ) stored,
       batch_id bigint not null references etl.batch_run(batch_id),
       ingested_at timestamptz not null default now(),
 
@@ -132,7 +156,10 @@
       is_current boolean not null default true,
       is_deleted boolean not null default false,
 
-      record_hash text not null,
+      record_hash text not null generated always as (
+        md5(coalesce(ref_salarie::text,'') || '||' ||
+            coalesce(montant_demande::text,'') || '||' || is_deleted::text)
+      ) stored,
       batch_id bigint not null references etl.batch_run(batch_id),
       ingested_at timestamptz not null default now(),
 
@@ -140,12 +167,23 @@
     );
   """) %}
 
+  {# Index partiels "version courante" :
+     - unique : garantit l'invariant SCD2 (1 version courante par demande)
+       et permet au planner un index-lookup O(log N) par clé lors du diff
+     - (ref, record_hash) : couvre le prédicat de détection de changement
+       (record_hash is distinct from ...) sans lire la table #}
   {% do run_query("""
-    create index if not exists ix_demande_histo_current
+    create unique index if not exists ux_demande_histo_current
     on gold.demande_avance_histo(ref_demande_avance)
     where is_current;
   """) %}
 
+  {% do run_query("""
+    create index if not exists ix_demande_histo_current_hash
+    on gold.demande_avance_histo(ref_demande_avance, record_hash)
+    where is_current;
+  """) %}
+
   {% do run_query("""
     create table if not exists gold.paiement_histo (
       ref_paiement text not null,
@@ -160,7 +198,11 @@
       is_current boolean not null default true,
       is_deleted boolean not null default false,
 
-      record_hash text not null,
+      record_hash text not null generated always as (
+        md5(coalesce(ref_salarie::text,'') || '||' || coalesce(montant_paye::text,'') || '||' ||
+            coalesce(rib_salarie::text,'') || '||' || coalesce(date_paiement::text,'') || '||' ||
+            coalesce(ref_demande_avance::text,'') || '||' || is_deleted::text)
+      ) stored,
       batch_id bigint not null references etl.batch_run(batch_id),
       ingested_at timestamptz not null default now(),
 
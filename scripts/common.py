@@ -12,20 +12,32 @@ Pourquoi etl.batch_run ?
 - Garantir la rejouabilité (re-run) sans doublons
 - Tracer l'origine technique de chaque chargement (batch_id)
 """
+import csv
+import io
 import os
 import hashlib
 from pathlib import Path
 
 import psycopg2
+import psycopg2.pool
 from dotenv import load_dotenv
-from psycopg2.extras import execute_values
 
 # Charge .env depuis la racine du projet (ags_case/.env)
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
 ENV_PATH = PROJECT_ROOT / ".env"
 load_dotenv(dotenv_path=ENV_PATH)
 
-def get_conn():
+# numeric -> float directement dans le driver : sans ce typecaster psycopg2
+# renvoie des Decimal que chaque script reconvertit ligne à ligne en float.
+# Enregistré une fois à l'import, valable pour toutes les connexions.
+DEC2FLOAT = psycopg2.extensions.new_type(
+    psycopg2.extensions.DECIMAL.values,
+    "DEC2FLOAT",
+    lambda value, cur: float(value) if value is not None else None,
+)
+psycopg2.extensions.register_type(DEC2FLOAT)
+
+def _conn_kwargs() -> dict:
     host = os.getenv("PGHOST")
     port = os.getenv("PGPORT")
     dbname = os.getenv("PGDATABASE")
@@ -43,7 +55,7 @@ def get_conn():
     if missing:
         raise RuntimeError(f"Missing env vars: {missing}. Check {ENV_PATH}")
 
-    return psycopg2.connect(
+    return dict(
         host=host,
         port=int(port),
         dbname=dbname,
@@ -51,12 +63,77 @@ def get_conn():
         password=password,
     )
 
+def get_conn():
+    return psycopg2.connect(**_conn_kwargs())
+
+# Pool de connexions process-local :
+# - un orchestrateur qui enchaîne plusieurs datasets/as_of dans le même
+#   process réutilise les connexions au lieu de payer un handshake
+#   TCP + auth par invocation
+# - lazy : les scripts lancés en one-shot via get_conn() ne créent pas
+#   de pool inutile
+_POOL: psycopg2.pool.ThreadedConnectionPool | None = None
+
+def get_pool(minconn: int = 2, maxconn: int = 8) -> psycopg2.pool.ThreadedConnectionPool:
+    """
+    Retourne le pool partagé du process (créé au premier appel).
+    Usage: conn = get_pool().getconn() ... get_pool().putconn(conn)
+    """
+    global _POOL
+    if _POOL is None:
+        _POOL = psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, **_conn_kwargs())
+    return _POOL
+
 def sha256_file(path: str) -> str:
-    h = hashlib.sha256()
+    # hashlib.file_digest (Python 3.11+) lit et hashe entièrement côté C
+    # (GIL relâché, buffers optimaux, SHA-NI via OpenSSL) : ~5-8x plus
+    # rapide que la boucle read/update en Python.
     with open(path, "rb") as f:
+        if hasattr(hashlib, "file_digest"):
+            return hashlib.file_digest(f, "sha256").hexdigest()
+        # Fallback < 3.11
+        h = hashlib.sha256()
         for chunk in iter(lambda: f.read(1024 * 1024), b""):
             h.update(chunk)
-    return h.hexdigest()
+        return h.hexdigest()
+
+def cached_sha256(conn, path: str) -> str:
+    """
+    SHA-256 avec cache d'empreinte (etl.file_fingerprint).
+    Tant que (path, size, mtime_ns) n'a pas bougé, le hash stocké est
+    réutilisé : re-runs du même fichier = zéro lecture disque, zéro CPU.
+    """
+    abs_path = str(Path(path).resolve())
+    st = os.stat(abs_path)
+
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            select sha256
+            from etl.file_fingerprint
+            where path=%s and size=%s and mtime_ns=%s
+            """,
+            (abs_path, st.st_size, st.st_mtime_ns),
+        )
+        row = cur.fetchone()
+        if row:
+            return row[0]
+
+        checksum = sha256_file(abs_path)
+        cur.execute(
+            """
+            insert into etl.file_fingerprint (path, size, mtime_ns, sha256, computed_at)
+            values (%s, %s, %s, %s, now())
+            on conflict (path)
+            do update set size=excluded.size,
+                          mtime_ns=excluded.mtime_ns,
+                          sha256=excluded.sha256,
+                          computed_at=now()
+            """,
+            (abs_path, st.st_size, st.st_mtime_ns, checksum),
+        )
+    conn.commit()
+    return checksum
 
 # Idempotence:
 # - si (dataset, as_of_date, checksum) existe déjà en SUCCESS => SKIP
@@ -91,6 +168,44 @@ def register_batch(conn, dataset: str, as_of_date: str, source_name: str, checks
     conn.commit()
     return batch_id
 
+# Cache process-local : quand plusieurs transforms gold s'enchaînent dans
+# le même process (orchestrateur), le même couple (dataset, as_of_date)
+# n'est recherché qu'une seule fois dans etl.batch_run.
+_BATCH_CACHE: dict[tuple[str, str], int] = {}
+
+def get_latest_batch_id(conn, dataset: str, as_of_date: str) -> int:
+    """
+    Récupère le dernier batch SUCCESS pour (dataset, as_of_date).
+    On s'appuie sur etl.batch_run déjà alimenté par l'ingestion Python.
+    Mémoïsé par process (un batch SUCCESS est immuable pour un as_of donné).
+    """
+    key = (dataset, as_of_date)
+    if key in _BATCH_CACHE:
+        return _BATCH_CACHE[key]
+
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            select batch_id
+            from etl.batch_run
+            where dataset = %s
+              and as_of_date = %s
+              and status = 'SUCCESS'
+            order by batch_id desc
+            limit 1
+            """,
+            (dataset, as_of_date),
+        )
+        row = cur.fetchone()
+        if not row:
+            raise RuntimeError(
+                f"No SUCCESS batch found in etl.batch_run for dataset={dataset} as_of_date={as_of_date}"
+            )
+        batch_id = int(row[0])
+
+    _BATCH_CACHE[key] = batch_id
+    return batch_id
+
 def finish_batch(conn, batch_id: int, status: str, message: str = ""):
     with conn.cursor() as cur:
         cur.execute(
@@ -103,25 +218,84 @@ def finish_batch(conn, batch_id: int, status: str, message: str = ""):
         )
     conn.commit()
 
+# Chargement en masse :
+# - COPY FROM STDIN évite la construction d'une requête VALUES géante
+#   (pas de parse par ligne côté serveur, 2-5x plus rapide que INSERT ... VALUES)
+
+def rows_to_csv_buffer(values: list[list]) -> io.StringIO:
+    """
+    Sérialise des lignes (listes de valeurs) en buffer CSV en mémoire,
+    prêt pour COPY ... FROM STDIN WITH (FORMAT csv).
+    None -> champ vide non quoté = NULL côté COPY.
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerows(values)
+    buf.seek(0)
+    return buf
+
 # Upsert silver_raw :
 # - on considère silver_raw comme la "landing zone" structurée
 # - on met à jour les enregistrements si la clé métier existe déjà
 # - cela permet de simuler les corrections ERP sur les flux suivants
+# - implémentation : le DataFrame est sérialisé en CSV directement vers
+#   COPY (pas de to_dict('records') ni de liste de listes intermédiaire),
+#   staging temporaire puis un seul INSERT ... SELECT ... ON CONFLICT
 
-def upsert_table(conn, table: str, pk_col: str, rows: list[dict], cols: list[str]):
-    if not rows:
-        return
+# Cache de SQL généré, par forme (table, pk, colonnes) : les f-strings de
+# staging/copy/merge ne sont construites qu'une fois par process, même si
+# l'upsert est appelé en boucle (plusieurs fichiers / chunks du même dataset).
+_UPSERT_SQL_CACHE: dict[tuple, tuple[str, str, str]] = {}
+
+def _upsert_sql(table: str, pk_col: str, cols: tuple[str, ...]) -> tuple[str, str, str]:
+    key = (table, pk_col, cols)
+    cached = _UPSERT_SQL_CACHE.get(key)
+    if cached is None:
+        col_list = ", ".join(cols)
+        set_clause = ", ".join([f"{c}=excluded.{c}" for c in cols if c != pk_col])
+        cached = (
+            f"create temp table stg (like {table} including defaults) on commit drop;",
+            f"copy stg ({col_list}) from stdin with (format csv, null '\\N')",
+            f"""
+            insert into {table} ({col_list})
+            select {col_list} from stg
+            on conflict ({pk_col})
+            do update set {set_clause}
+            """,
+        )
+        _UPSERT_SQL_CACHE[key] = cached
+    return cached
 
-    values = [[r.get(c) for c in cols] for r in rows]
-    col_list = ", ".join(cols)
-    set_clause = ", ".join([f"{c}=excluded.{c}" for c in cols if c != pk_col])
+def _copy_df_to_stage(cur, copy_sql: str, df, cols: list[str]):
+    # na_rep='\\N' aligné sur le marqueur NULL du COPY: un champ vide reste
+    # une chaîne vide, seul \\N devient NULL côté Postgres
+    buf = io.StringIO()
+    df[cols].to_csv(buf, index=False, header=False, na_rep="\\N")
+    buf.seek(0)
+    cur.copy_expert(copy_sql, buf)
 
-    sql = f"""
-        insert into {table} ({col_list})
-        values %s
-        on conflict ({pk_col})
-        do update set {set_clause}
+def upsert_chunks(conn, table: str, pk_col: str, chunks, cols: list[str]) -> int:
+    """
+    Upsert en flux : chaque chunk (DataFrame) est copié dans la table de
+    staging au fil de l'eau, puis UN seul merge final vers la cible.
+    La mémoire pic reste bornée à la taille d'un chunk, pas du fichier.
+    Retourne le nombre total de lignes stagées.
     """
+    stage_sql, copy_sql, merge_sql = _upsert_sql(table, pk_col, tuple(cols))
+
+    total = 0
     with conn.cursor() as cur:
-        execute_values(cur, sql, values)
+        cur.execute(stage_sql)
+        for chunk in chunks:
+            if chunk.empty:
+                continue
+            _copy_df_to_stage(cur, copy_sql, chunk, cols)
+            total += len(chunk)
+        cur.execute(merge_sql)
     conn.commit()
+    return total
+
+def upsert_dataframe(conn, table: str, pk_col: str, df, cols: list[str]):
+    if df.empty:
+        return
+    upsert_chunks(conn, table, pk_col, [df], cols)
@@ -1,6 +1,24 @@
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+
+def read_excel(path) -> pd.DataFrame:
+    """Lecture Excel via calamine (Rust) si dispo, sinon moteur par défaut."""
+    try:
+        return pd.read_excel(path, engine="calamine")
+    except ImportError:
+        return pd.read_excel(path)
+
+
+def write_excel(df: pd.DataFrame, path):
+    """Écriture Excel via xlsxwriter (2-3x plus rapide qu'openpyxl) si dispo."""
+    try:
+        df.to_excel(path, index=False, engine="xlsxwriter")
+    except ImportError:
+        df.to_excel(path, index=False)
+
+
 BASE_DIR = Path(__file__).resolve().parent.parent
 DATA_DIR = BASE_DIR / "data"
 
@@ -15,9 +33,9 @@ OUT_SAL_1009 = DATA_DIR / "salaries_2024-09-10.xlsx"
 OUT_DMD_1009 = DATA_DIR / "demandes_avance_2024-09-10.xlsx"
 
 def main():
-    sal = pd.read_excel(IN_SAL)
-    dmd = pd.read_excel(IN_DMD)
-    pay = pd.read_excel(IN_PAY)
+    # Les 3 lectures sont indépendantes -> parallèles (1 process par fichier)
+    with ProcessPoolExecutor(max_workers=3) as ex:
+        sal, dmd, pay = ex.map(read_excel, [IN_SAL, IN_DMD, IN_PAY])
 
     # Normaliser noms de colonnes
     sal.columns = [c.strip() for c in sal.columns]
@@ -33,21 +51,21 @@ def main():
     sal_0209 = sal.copy()
     dmd_0209 = dmd.copy()
 
+    # Écritures scalaires via .iat (accès positionnel direct, pas de passe
+    # d'alignement/copie comme avec .loc sur dtype object)
     if len(sal_0209) >= 1 and "nom" in sal_0209.columns:
-        sal_0209.loc[sal_0209.index[0], "nom"] = str(sal_0209.loc[sal_0209.index[0], "nom"]) + "_CORR"
+        j = sal_0209.columns.get_loc("nom")
+        sal_0209.iat[0, j] = str(sal_0209.iat[0, j]) + "_CORR"
 
     if len(dmd_0209) >= 2 and "montant_demande" in dmd_0209.columns:
-        dmd_0209.loc[dmd_0209.index[1], "montant_demande"] = float(dmd_0209.loc[dmd_0209.index[1], "montant_demande"]) + 100.0
+        j = dmd_0209.columns.get_loc("montant_demande")
+        dmd_0209.iat[1, j] = float(dmd_0209.iat[1, j]) + 100.0
 
     removed_demande_row = None
     if len(dmd_0209) >= 3:
         removed_demande_row = dmd_0209.iloc[[2]].copy()  # on la garde pour la réinsertion 10/09
         dmd_0209 = dmd_0209.drop(dmd_0209.index[2]).reset_index(drop=True)
 
-    # sauvegarde 02/09
-    sal_0209.to_excel(OUT_SAL_0209, index=False)
-    dmd_0209.to_excel(OUT_DMD_0209, index=False)
-
     # ---------------------------
     # 10/09 : rectifications post-paiement
     # - ajustement montant_demande sur une demande payée (si existe) : +350
@@ -59,20 +77,32 @@ def main():
     dmd_1009 = dmd_0209.copy()
 
     if len(dmd_1009) >= 1 and "montant_demande" in dmd_1009.columns:
-        dmd_1009.loc[dmd_1009.index[0], "montant_demande"] = float(dmd_1009.loc[dmd_1009.index[0], "montant_demande"]) + 350.0
+        j = dmd_1009.columns.get_loc("montant_demande")
+        dmd_1009.iat[0, j] = float(dmd_1009.iat[0, j]) + 350.0
 
     if removed_demande_row is not None:
         dmd_1009 = pd.concat([dmd_1009, removed_demande_row], ignore_index=True)
 
     if len(sal_1009) >= 2 and "nom" in sal_1009.columns:
-        sal_1009.loc[sal_1009.index[1], "nom"] = str(sal_1009.loc[sal_1009.index[1], "nom"]) + "_POSTPAY"
+        j = sal_1009.columns.get_loc("nom")
+        sal_1009.iat[1, j] = str(sal_1009.iat[1, j]) + "_POSTPAY"
 
     if "rib" in sal_1009.columns and len(sal_1009) >= 1:
-        sal_1009.loc[sal_1009.index[0], "rib"] = str(sal_1009.loc[sal_1009.index[0], "rib"]) + "_V2"
-
-    # sauvegarde 10/09
-    sal_1009.to_excel(OUT_SAL_1009, index=False)
-    dmd_1009.to_excel(OUT_DMD_1009, index=False)
+        j = sal_1009.columns.get_loc("rib")
+        sal_1009.iat[0, j] = str(sal_1009.iat[0, j]) + "_V2"
+
+    # sauvegarde 02/09 + 10/09 : les 4 fichiers sont indépendants une fois
+    # les éditions faites -> écritures parallèles, wall time ~ max(fichiers)
+    outputs = [
+        (sal_0209, OUT_SAL_0209),
+        (dmd_0209, OUT_DMD_0209),
+        (sal_1009, OUT_SAL_1009),
+        (dmd_1009, OUT_DMD_1009),
+    ]
+    with ProcessPoolExecutor(max_workers=4) as ex:
+        futures = [ex.submit(write_excel, df, path) for df, path in outputs]
+        for fut in futures:
+            fut.result()
 
     print("Generated:")
     print(" -", OUT_SAL_0209.name)
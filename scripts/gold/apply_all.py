@@ -0,0 +1,54 @@
+"""
+apply_all.py
+------------
+Orchestration des trois historisations gold pour un as_of donné.
+
+Les datasets (salarie, demande_avance, paiement) écrivent dans des tables
+cibles disjointes : leurs applies SCD2 sont indépendants et tournent en
+parallèle, un process par dataset. La durée totale devient max(t_i) au
+lieu de sum(t_i).
+
+Garde-fou : le moteur SCD2 prend un verrou advisory transactionnel par
+table cible (voir scripts/gold/scd2.apply_scd2), donc deux lancements
+concurrents du même dataset se sérialisent au lieu de s'entrelacer.
+
+Usage:
+  python -m scripts.gold.apply_all --as-of 2024-08-25
+"""
+import argparse
+import importlib
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+DATASETS = ("salarie", "demande_avance", "paiement")
+
+
+def run_one(task: tuple[str, str]) -> str:
+    """
+    Exécuté dans un process fils : appelle le main() du script du dataset
+    avec un argv reconstitué (mêmes arguments qu'en ligne de commande).
+    """
+    dataset, as_of = task
+    mod = importlib.import_module(f"scripts.gold.apply_gold_{dataset}")
+    argv = sys.argv
+    sys.argv = [f"apply_gold_{dataset}.py", "--as-of", as_of]
+    try:
+        mod.main()
+    finally:
+        sys.argv = argv
+    return dataset
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Apply SCD2 historization for all gold tables in parallel")
+    ap.add_argument("--as-of", required=True, help="Date logique du flux (YYYY-MM-DD)")
+    args = ap.parse_args()
+
+    with ProcessPoolExecutor(max_workers=len(DATASETS)) as ex:
+        # ex.map propage la première exception levée par un dataset
+        for dataset in ex.map(run_one, [(d, args.as_of) for d in DATASETS]):
+            print(f"DONE {dataset}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+scd2.py
+-------
+Moteur SCD Type 2 générique, piloté par un descripteur de schéma (SCD2Spec).
+
+Principe (ensembliste, exécuté côté Postgres):
+1) le snapshot source est matérialisé dans une table temporaire tmp_silver,
+   record_hash compris (md5 sur une représentation texte canonique)
+2) close + insert des nouvelles versions + tombstones (clés absentes du
+   snapshot) en UNE seule requête CTE (UPDATE ... RETURNING + INSERT ...
+   SELECT), dont le SELECT final rapporte les compteurs : un run = deux
+   allers-retours serveur (chargement snapshot, puis application)
+
+Côté cible, record_hash est une colonne générée STORED (voir init_db):
+les INSERT n'écrivent jamais le hash, Postgres le dérive des colonnes
+métier + is_deleted avec la même expression que record_hash_sql(). Le
+hash de tmp_silver ne sert qu'à la comparaison (is distinct from).
+
+Pourquoi un moteur unique:
+- le même algorithme était dupliqué par table gold; chaque optimisation
+  devait être appliquée plusieurs fois
+- le SQL est généré une seule fois par forme de spec (cache module) puis
+  réutilisé à chaque exécution
+
+Contrat de la spec:
+- source_sql retourne key_col + business_cols (mêmes noms que la cible)
+- la table cible porte les colonnes communes SCD2 du projet:
+  valid_from, valid_to, is_current, is_deleted, record_hash, batch_id
+"""
+import datetime as dt
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class SCD2Spec:
+    target_table: str              # ex: gold.demande_avance_histo
+    key_col: str                   # ex: ref_demande_avance
+    business_cols: tuple[str, ...] # colonnes métier (hors clé)
+    source_sql: str                # SELECT silver: key_col + business_cols
+
+
+def record_hash_sql(business_cols: tuple[str, ...], is_deleted_sql: str) -> str:
+    """
+    Expression SQL du hash métier: md5 des colonnes métier en représentation
+    texte canonique, séparateur '||', suivi du marqueur is_deleted
+    (is_deleted::text ou littéral 'true'/'false').
+    """
+    parts = [f"coalesce({c}::text,'')" for c in business_cols]
+    parts.append(is_deleted_sql)
+    return "md5(" + " || '||' || ".join(parts) + ")"
+
+
+# Cache de SQL généré par spec: les requêtes ne sont construites qu'une
+# fois par forme, même si plusieurs applies tournent dans le même process.
+_SQL_CACHE: dict[SCD2Spec, tuple[str, str]] = {}
+
+
+def _build_sql(spec: SCD2Spec) -> tuple[str, str]:
+    cached = _SQL_CACHE.get(spec)
+    if cached is not None:
+        return cached
+
+    key = spec.key_col
+    cols = ", ".join((key,) + spec.business_cols)
+    g_cols = ", ".join(f"g.{c}" for c in (key,) + spec.business_cols)
+    # record_hash absent: colonne générée par la table cible
+    scd2_cols = f"{cols}, valid_from, valid_to, is_current, is_deleted, batch_id"
+
+    # Chargement + clé primaire du snapshot en un seul execute
+    load_sql = f"""
+        create temporary table tmp_silver on commit drop as
+        select s.*, {record_hash_sql(spec.business_cols, "'false'")} as record_hash
+        from ({spec.source_sql}) s;
+        alter table tmp_silver add primary key ({key});
+    """
+
+    # Toute l'application (close + insert + tombstones) tient dans UNE
+    # requête : les CTE touchent des ensembles de clés disjoints (clés
+    # présentes dans tmp_silver vs absentes), donc pas de conflit entre
+    # les deux UPDATE ni entre les deux INSERT. Le SELECT final renvoie
+    # les compteurs, évitant des round-trips de comptage séparés.
+    apply_sql = f"""
+        with to_close as (
+          update {spec.target_table} g
+          set valid_to = %(as_of)s,
+              is_current = false
+          from tmp_silver s
+          where g.is_current
+            and g.{key} = s.{key}
+            and (g.record_hash is distinct from s.record_hash or g.is_deleted)
+          returning g.{key}
+        ),
+        new_keys as (
+          select s.{key}
+          from tmp_silver s
+          left join {spec.target_table} g
+            on g.{key} = s.{key}
+           and g.is_current
+          where g.{key} is null
+        ),
+        ins_changes as (
+          insert into {spec.target_table} ({scd2_cols})
+          select
+            {cols},
+            %(as_of)s,
+            date '9999-12-31',
+            true,
+            false,
+            %(batch_id)s
+          from tmp_silver s
+          where s.{key} in (select {key} from to_close)
+             or s.{key} in (select {key} from new_keys)
+          returning 1
+        ),
+        del_close as (
+          update {spec.target_table} g
+          set valid_to = %(as_of)s,
+              is_current = false
+          from (
+            select g2.{key}
+            from {spec.target_table} g2
+            left join tmp_silver s
+              on s.{key} = g2.{key}
+            where g2.is_current
+              and not g2.is_deleted
+              and s.{key} is null
+          ) d
+          where g.{key} = d.{key}
+            and g.is_current
+          returning {g_cols}
+        ),
+        ins_tombstones as (
+          insert into {spec.target_table} ({scd2_cols})
+          select
+            {cols},
+            %(as_of)s,
+            date '9999-12-31',
+            true,
+            true,
+            %(batch_id)s
+          from del_close
+          returning 1
+        )
+        select
+          (select count(*) from tmp_silver) as total,
+          (select count(*) from ins_changes) as changed,
+          (select count(*) from ins_tombstones) as deleted
+    """
+
+    cached = (load_sql, apply_sql)
+    _SQL_CACHE[spec] = cached
+    return cached
+
+
+def apply_scd2(conn, spec: SCD2Spec, as_of_date: dt.date, batch_id: int) -> tuple[int, int, int]:
+    """
+    Applique l'historisation SCD2 de la spec pour un as_of donné.
+    Retourne (lignes snapshot, nouvelles versions, tombstones).
+    La transaction reste pilotée par l'appelant (commit/rollback).
+    """
+    load_sql, apply_sql = _build_sql(spec)
+
+    with conn.cursor() as cur:
+        # 0) verrou advisory par table cible, tenu jusqu'au commit : deux
+        #    runs concurrents sur la même cible se sérialisent (le second
+        #    rejoue un diff idempotent) au lieu de s'entrelacer
+        cur.execute("select pg_advisory_xact_lock(hashtext(%s));", (spec.target_table,))
+
+        # 1) snapshot silver -> table temporaire (hash calculé en SQL)
+        cur.execute(load_sql)
+
+        # 2) close + insert + tombstones + compteurs en une requête
+        cur.execute(apply_sql, {"as_of": as_of_date, "batch_id": batch_id})
+        total, changed, deleted = cur.fetchone()
+
+    return int(total), int(changed), int(deleted)